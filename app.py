@@ -1,10 +1,8 @@
 import re
-from io import BytesIO
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-import pdfplumber
 import streamlit as st
 import fitz  # PyMuPDF
 
@@ -44,53 +42,102 @@ TARGETS = {
     ],
 }
 
+HEADERS_SET = frozenset(HEADERS)
 
-def extract_full_text(pdf_bytes: bytes) -> str:
-    """Extract text from all pages of a PDF."""
-    out_lines: List[str] = []
-    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
-        for page in pdf.pages:
-            txt = page.extract_text(layout=True) or ""
-            out_lines.append(txt)
-    text = "\n".join(out_lines)
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
-    return text
+# The default "text" flags minus TEXT_PRESERVE_LIGATURES: the only effect is that
+# ligature glyphs (e.g. U+FB01 "ﬁ") come out as plain letters, so they match labels.
+# Only get_text() is called on pages; images and drawings are never decoded.
+TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_LIGATURES
 
+# Every label keyed by its lowercased form; a line is classified with one lookup
+# of the text before its first colon.
+LABEL_BY_LOWER = {label.lower(): label for labels in TARGETS.values() for label in labels}
+HONORIFIC_RE = re.compile(r"^(Herr|Frau|Firma)\b")
 
-def split_lines(text: str) -> List[str]:
-    return [ln.strip() for ln in text.split("\n")]
 
+def iter_page_texts(pdf_bytes: bytes) -> Iterator[str]:
+    """Yield the text of each page in order."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        for page in doc:
+            yield page.get_text("text", flags=TEXT_FLAGS)
+    finally:
+        doc.close()
 
-def find_header_indices(lines: List[str], headers: List[str]) -> Dict[str, int]:
-    idx_map = {}
-    for i, ln in enumerate(lines):
-        if ln in headers and ln not in idx_map:
-            idx_map[ln] = i
-    return idx_map
 
+def iter_lines(pdf_bytes: bytes) -> Iterator[str]:
+    """
+    Yield stripped, non-empty text lines of all pages, without joining the whole document first.
+    Stops after the page on which every header has appeared and the last opened section
+    has all of its TARGETS labels: nothing later can change the result.
+    """
+    missing_headers = set(HEADERS)
+    open_labels: Set[str] = set()
+    for txt in iter_page_texts(pdf_bytes):
+        for raw in txt.splitlines():
+            ln = raw.strip()
+            if not ln:
+                continue
+            if ln in missing_headers:
+                # first occurrence opens the section (same rule as split_sections)
+                missing_headers.discard(ln)
+                open_labels = set(TARGETS.get(ln, []))
+            elif open_labels:
+                hit = _match_label(ln)
+                if hit:
+                    open_labels.discard(hit[0])
+            yield ln
+        if not missing_headers and not open_labels:
+            break
 
-def get_section_slice(lines: List[str], header: str, header_indices: Dict[str, int]) -> Tuple[int, int]:
-    if header not in header_indices:
-        return (-1, -1)
-    start = header_indices[header] + 1
-    current_idx = header_indices[header]
-    end = len(lines)
 
-    starts_sorted = sorted((h, idx) for h, idx in header_indices.items())
-    for _, idx in starts_sorted:
-        if idx > current_idx:
-            end = idx
-            break
-    return start, end
+def split_sections(lines: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Single pass over lines: each header opens a section that runs until the next header.
+    Only the first occurrence of a header starts a section; repeats stay in the running section.
+    Returns: { section_header: [line, ...] }
+    """
+    sections: Dict[str, List[str]] = {}
+    current: Optional[List[str]] = None
+    for ln in lines:
+        if ln in HEADERS_SET and ln not in sections:
+            current = sections[ln] = []
+        elif current is not None:
+            current.append(ln)
+    return sections
+
+
+def _match_label(ln: str) -> Optional[Tuple[str, str]]:
+    """
+    Classify a 'Label: value' line against all labels at once.
+    Returns: (label, value) or None
+    """
+    head, sep, rest = ln.partition(":")
+    if not sep:
+        return None
+    label = LABEL_BY_LOWER.get(head.rstrip().lower())
+    val = rest.lstrip()  # line is already stripped
+    if label is None or not val:
+        return None
+    return label, val
 
 
-def extract_value_after_colon(section_lines: List[str], label: str) -> Optional[str]:
-    pattern = rf"^{re.escape(label)}\s*:\s*(.+?)\s*$"
+def extract_label_values(section_lines: List[str], labels: List[str]) -> Dict[str, str]:
+    """
+    Scan each line once, stopping as soon as every label is found.
+    Returns: { label: value } (first occurrence wins, label in TARGETS spelling)
+    """
+    found: Dict[str, str] = {}
+    remaining = set(labels)
     for ln in section_lines:
-        m = re.match(pattern, ln, flags=re.IGNORECASE)
-        if m:
-            return m.group(1).strip()
-    return None
+        if not remaining:
+            break
+        hit = _match_label(ln)
+        if hit and hit[0] in remaining:
+            label, val = hit
+            found[label] = val
+            remaining.discard(label)
+    return found
 
 
 def extract_first_person_name(section_lines: List[str]) -> Optional[str]:
@@ -99,36 +146,32 @@ def extract_first_person_name(section_lines: List[str]) -> Optional[str]:
     'Herr XY' (not 'Name: ...').
     """
     for ln in section_lines:
-        if not ln:
-            continue
         if ":" in ln:
             continue
-        if ln in HEADERS:
+        if ln in HEADERS_SET:
             continue
         # common honorifics
-        if re.match(r"^(Herr|Frau)\b", ln):
-            return ln.strip()
+        if HONORIFIC_RE.match(ln):
+            return ln
         # fallback: first plain non-empty line
-        return ln.strip()
+        return ln
     return None
 
 
+@st.cache_data(show_spinner=False, max_entries=16)
 def extract_requested_fields(pdf_bytes: bytes) -> Dict[str, List[str]]:
     """
     Returns: { section_header: ["Field: Value", ...] }
     """
-    text = extract_full_text(pdf_bytes)
-    lines = split_lines(text)
-    header_indices = find_header_indices(lines, HEADERS)
+    sections = split_sections(iter_lines(pdf_bytes))
 
     results: Dict[str, List[str]] = {}
 
     for header in HEADERS:
-        start, end = get_section_slice(lines, header, header_indices)
-        if start == -1:
+        if header not in sections:
             continue
 
-        section_lines = lines[start:end]
+        section_lines = sections[header]
         section_out: List[str] = []
 
         # Special: Anschlussnehmer name line
@@ -138,10 +181,11 @@ def extract_requested_fields(pdf_bytes: bytes) -> Dict[str, List[str]]:
                 section_out.append(f"Name: {name}")
 
         # Standard labels
-        for label in TARGETS.get(header, []):
-            val = extract_value_after_colon(section_lines, label)
-            if val is not None:
-                section_out.append(f"{label}: {val}")
+        labels = TARGETS.get(header, [])
+        found = extract_label_values(section_lines, labels)
+        for label in labels:
+            if label in found:
+                section_out.append(f"{label}: {found[label]}")
 
         if section_out:
             results[header] = section_out
@@ -161,59 +205,107 @@ def format_as_txt(results: Dict[str, List[str]]) -> str:
     return "\n".join(parts).strip() + "\n"
 
 
-def _get_value(results_by_section: Dict[str, List[str]], section: str, label: str) -> str:
-    for ln in results_by_section.get(section, []):
-        ln = ln.lstrip("- ").strip()
-        if ln.lower().startswith(label.lower() + ":"):
-            return ln.split(":", 1)[1].strip()
-    return ""
+def _section_pairs(results_by_section: Dict[str, List[str]]) -> Dict[str, Dict[str, str]]:
+    """
+    Index each section's "Field: Value" lines once.
+    Returns: { section_header: { field_lower: value } } (first occurrence wins)
+    """
+    pairs_by_section: Dict[str, Dict[str, str]] = {}
+    for section, lines in results_by_section.items():
+        pairs: Dict[str, str] = {}
+        for ln in lines:
+            key, sep, val = ln.partition(":")
+            if sep:
+                pairs.setdefault(key.lstrip("- ").strip().lower(), val.strip())
+        pairs_by_section[section] = pairs
+    return pairs_by_section
+
+
+def _get_value(pairs_by_section: Dict[str, Dict[str, str]], section: str, label: str) -> str:
+    return pairs_by_section.get(section, {}).get(label.lower(), "")
 
 
 def build_extracted_dict(results_by_section: Dict[str, List[str]]) -> Dict[str, str]:
-    name_line = ""
-    for ln in results_by_section.get("Anschlussnehmer", []):
-        ln = ln.lstrip("- ").strip()
-        if ln.lower().startswith("name:"):
-            name_line = ln.split(":", 1)[1].strip()
-            break
+    pairs = _section_pairs(results_by_section)
 
     return {
-        "name": name_line,
-        "anschrift": _get_value(results_by_section, "Anschlussnehmer", "Anschrift"),
-        "telefon": _get_value(results_by_section, "Anschlussnehmer", "Erreichbarkeit Telefon"),
-        "anschlussort_strasse": _get_value(results_by_section, "Anschlussort", "Straße"),
-        "messkonzept": _get_value(results_by_section, "Angaben zur Kundenanlage", "Mess- und Betriebskonzept"),
-        "pv_kwp": _get_value(results_by_section, "Angaben zu den PV-Modulen", "Gesamtleistung aller PV-Module in kWp"),
-        "speicher_kwh": _get_value(results_by_section, "Angaben zur Speichereinheit", "Bruttokapazität des Speichereinheit"),
+        "name": _get_value(pairs, "Anschlussnehmer", "Name"),
+        "anschrift": _get_value(pairs, "Anschlussnehmer", "Anschrift"),
+        "telefon": _get_value(pairs, "Anschlussnehmer", "Erreichbarkeit Telefon"),
+        "anschlussort_strasse": _get_value(pairs, "Anschlussort", "Straße"),
+        "messkonzept": _get_value(pairs, "Angaben zur Kundenanlage", "Mess- und Betriebskonzept"),
+        "pv_kwp": _get_value(pairs, "Angaben zu den PV-Modulen", "Gesamtleistung aller PV-Module in kWp"),
+        "speicher_kwh": _get_value(pairs, "Angaben zur Speichereinheit", "Bruttokapazität des Speichereinheit"),
     }
 
 
 # -----------------------------
 # 2) FILL FILLABLE PDF (ACROFORM)
 # -----------------------------
-def _set_text_field(doc: fitz.Document, field_name: str, value: str) -> None:
-    for page in doc:
-        widgets = page.widgets() or []
-        for w in widgets:
-            if w.field_name == field_name:
-                w.field_value = value or ""
-                w.update()
-                return
-
-
-def _set_checkbox(doc: fitz.Document, field_name: str, checked: bool) -> None:
-    for page in doc:
-        widgets = page.widgets() or []
-        for w in widgets:
-            if w.field_name == field_name:
-                # Use actual "on" state from PDF (could be "Ja", "On", etc.)
-                w.field_value = w.on_state() if checked else "Off"
-                w.update()
-                return
-
-
-def fill_template_pdf(template_pdf_bytes: bytes, extracted: Dict[str, str]) -> bytes:
+def _build_widget_map(doc: fitz.Document) -> Tuple[List[fitz.Page], Dict[str, fitz.Widget]]:
     """
+    Index form widgets by field name once (first widget per name, page order).
+    Returns: (pages, widget_map) - keep the pages alive as long as the map is used,
+    a widget whose page was garbage-collected can no longer be updated.
+    """
+    pages = list(doc)
+    widget_map: Dict[str, fitz.Widget] = {}
+    for page in pages:
+        for w in page.widgets() or []:
+            widget_map.setdefault(w.field_name, w)
+    return pages, widget_map
+
+
+def _set_text_field(widget_map: Dict[str, fitz.Widget], field_name: str, value: str) -> None:
+    w = widget_map.get(field_name)
+    if w:
+        w.field_value = value or ""
+        w.update()
+
+
+def _set_checkbox(widget_map: Dict[str, fitz.Widget], field_name: str, checked: bool) -> None:
+    w = widget_map.get(field_name)
+    if w:
+        # Use actual "on" state from PDF (could be "Ja", "On", etc.)
+        w.field_value = w.on_state() if checked else "Off"
+        w.update()
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def index_template(template_pdf_bytes: bytes) -> Dict[str, Tuple[int, int]]:
+    """
+    Scan the template's widgets once per distinct template.
+    Only plain numbers are cached; every fill still works on its own freshly opened document.
+    Returns: { field_name: (page_number, widget_xref) }
+    """
+    doc = fitz.open(stream=template_pdf_bytes, filetype="pdf")
+    _pages, widget_map = _build_widget_map(doc)
+    index = {name: (w.parent.number, w.xref) for name, w in widget_map.items()}
+    doc.close()
+    return index
+
+
+def _load_widget_map(
+    doc: fitz.Document, index: Dict[str, Tuple[int, int]]
+) -> Tuple[Dict[int, fitz.Page], Dict[str, fitz.Widget]]:
+    """
+    Load only the indexed widgets by xref instead of walking every widget on every page.
+    Returns: (pages, widget_map) - keep the pages alive as long as the map is used.
+    """
+    pages: Dict[int, fitz.Page] = {}
+    widget_map: Dict[str, fitz.Widget] = {}
+    for name, (pno, xref) in index.items():
+        if pno not in pages:
+            pages[pno] = doc[pno]
+        widget_map[name] = pages[pno].load_widget(xref)
+    return pages, widget_map
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def fill_template_pdf(template_pdf_bytes: bytes, extracted: Dict[str, str], today: str) -> bytes:
+    """
+    today (DD.MM.YYYY) is passed in so it is part of the cache key.
+
     Field mapping based on YOUR fillable PDF field names:
       - Name Vorname
       - Straße  Nr  Ort
@@ -225,36 +317,37 @@ def fill_template_pdf(template_pdf_bytes: bytes, extracted: Dict[str, str]) -> b
       - ja_2
     """
     doc = fitz.open(stream=template_pdf_bytes, filetype="pdf")
+    _pages, widget_map = _load_widget_map(doc, index_template(template_pdf_bytes))
 
     # 1) Angaben zum Anlagenbetreiber
-    _set_text_field(doc, "Name Vorname", extracted.get("name", ""))
-    _set_text_field(doc, "Straße  Nr  Ort", extracted.get("anschrift", ""))
-    _set_text_field(doc, "Telefonnummer", extracted.get("telefon", ""))
+    _set_text_field(widget_map, "Name Vorname", extracted.get("name", ""))
+    _set_text_field(widget_map, "Straße  Nr  Ort", extracted.get("anschrift", ""))
+    _set_text_field(widget_map, "Telefonnummer", extracted.get("telefon", ""))
 
     # 2) Standort der Photovoltaikanlage
-    _set_text_field(doc, "2 Standort der Photovoltaikanlage", extracted.get("anschlussort_strasse", ""))
+    _set_text_field(widget_map, "2 Standort der Photovoltaikanlage", extracted.get("anschlussort_strasse", ""))
 
     # Unterlagen checkboxes
-    _set_checkbox(doc, "Check 1", True)
-    _set_checkbox(doc, "Check 5", True)
-    _set_checkbox(doc, "Check 7", True)
-    _set_checkbox(doc, "Check 9", True)
+    _set_checkbox(widget_map, "Check 1", True)
+    _set_checkbox(widget_map, "Check 5", True)
+    _set_checkbox(widget_map, "Check 7", True)
+    _set_checkbox(widget_map, "Check 9", True)
 
     # Bemerkung 5 = current date DD.MM.YYYY (Berlin time)
-    today = datetime.now(ZoneInfo("Europe/Berlin")).strftime("%d.%m.%Y")
-    _set_text_field(doc, "Bemerkung 5", today)
+    _set_text_field(widget_map, "Bemerkung 5", today)
 
     # Bemerkung 9 = Mess- und Betriebskonzept
-    _set_text_field(doc, "Bemerkung 9", extracted.get("messkonzept", ""))
+    _set_text_field(widget_map, "Bemerkung 9", extracted.get("messkonzept", ""))
 
     # 3) Technische Daten
-    _set_text_field(doc, "kWp", extracted.get("pv_kwp", ""))
+    _set_text_field(widget_map, "kWp", extracted.get("pv_kwp", ""))
 
     speicher_kwh = (extracted.get("speicher_kwh") or "").strip()
-    _set_text_field(doc, "kWh", speicher_kwh)
-    _set_checkbox(doc, "ja_2", bool(speicher_kwh))
+    _set_text_field(widget_map, "kWh", speicher_kwh)
+    _set_checkbox(widget_map, "ja_2", bool(speicher_kwh))
 
-    out = doc.tobytes(deflate=True)
+    # No deflate: only widget values changed, re-compressing every stream is wasted work.
+    out = doc.tobytes(deflate=False)
     doc.close()
     return out
 
@@ -298,8 +391,11 @@ if source_pdf:
     if template_pdf:
         template_bytes = template_pdf.read()
 
+        # Bemerkung 5 = current date DD.MM.YYYY (Berlin time)
+        today = datetime.now(ZoneInfo("Europe/Berlin")).strftime("%d.%m.%Y")
+
         with st.spinner("Fülle Template PDF..."):
-            filled_pdf_bytes = fill_template_pdf(template_bytes, extracted_dict)
+            filled_pdf_bytes = fill_template_pdf(template_bytes, extracted_dict, today)
 
         st.download_button(
             "Gefülltes PDF herunterladen",
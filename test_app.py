@@ -0,0 +1,163 @@
+from typing import Tuple
+
+import fitz
+
+import app
+
+
+TEXT_FIELDS = [
+    "Name Vorname",
+    "Straße  Nr  Ort",
+    "Telefonnummer",
+    "2 Standort der Photovoltaikanlage",
+    "Bemerkung 5",
+    "Bemerkung 9",
+    "kWp",
+    "kWh",
+]
+CHECKBOXES = ["Check 1", "Check 5", "Check 7", "Check 9", "ja_2"]
+
+
+def make_template() -> bytes:
+    """Small AcroForm with the field names fill_template_pdf writes to."""
+    doc = fitz.open()
+    page = doc.new_page()
+    y = 20
+    for name, field_type, width in (
+        [(n, fitz.PDF_WIDGET_TYPE_TEXT, 280) for n in TEXT_FIELDS]
+        + [(n, fitz.PDF_WIDGET_TYPE_CHECKBOX, 15) for n in CHECKBOXES]
+    ):
+        w = fitz.Widget()
+        w.field_name = name
+        w.field_type = field_type
+        w.rect = fitz.Rect(20, y, 20 + width, y + 18)
+        page.add_widget(w)
+        y += 25
+    out = doc.tobytes()
+    doc.close()
+    return out
+
+
+def read_fields(pdf_bytes: bytes) -> dict:
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    values = {w.field_name: w.field_value for page in doc for w in page.widgets()}
+    doc.close()
+    return values
+
+
+def test_fill_template_pdf_sets_fields():
+    extracted = {
+        "name": "Herr Max Muster",
+        "anschrift": "Weg 1, 12345 Ort",
+        "telefon": "0123 456",
+        "anschlussort_strasse": "Straße 2",
+        "messkonzept": "Überschusseinspeisung",
+        "pv_kwp": "9,8",
+        "speicher_kwh": "10",
+    }
+    values = read_fields(app.fill_template_pdf(make_template(), extracted, "01.02.2026"))
+
+    assert values["Name Vorname"] == "Herr Max Muster"
+    assert values["Straße  Nr  Ort"] == "Weg 1, 12345 Ort"
+    assert values["Telefonnummer"] == "0123 456"
+    assert values["2 Standort der Photovoltaikanlage"] == "Straße 2"
+    assert values["Bemerkung 5"] == "01.02.2026"
+    assert values["Bemerkung 9"] == "Überschusseinspeisung"
+    assert values["kWp"] == "9,8"
+    assert values["kWh"] == "10"
+    for name in CHECKBOXES:
+        assert values[name] not in ("Off", "", None)
+
+
+def xref_count(pdf_bytes: bytes) -> int:
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    count = doc.xref_length()
+    doc.close()
+    return count
+
+
+def test_fill_template_pdf_reuses_cached_template():
+    template = make_template()
+    first = {"name": "Herr Max Muster", "speicher_kwh": "10"}
+    second = {"name": "Frau X", "speicher_kwh": ""}
+    object_counts = {}
+    for i in range(20):
+        extracted = first if i % 2 == 0 else second
+        # a new date each time so fill_template_pdf's own cache never short-circuits the fill
+        out = app.fill_template_pdf(template, extracted, f"{i + 1:02d}.01.2026")
+        values = read_fields(out)
+
+        assert values["Name Vorname"] == extracted["name"]
+        assert values["kWh"] == extracted["speicher_kwh"]
+        assert values["Bemerkung 5"] == f"{i + 1:02d}.01.2026"
+        assert (values["ja_2"] not in ("Off", "", None)) == bool(extracted["speicher_kwh"])
+        object_counts.setdefault(i % 2, set()).add(xref_count(out))
+
+    # earlier fills must not leak objects into later ones
+    assert all(len(counts) == 1 for counts in object_counts.values())
+
+
+def make_template_with_kid_checkbox() -> Tuple[bytes, int]:
+    """make_template(), but "ja_2" is a parent field whose only kid is the widget (Acrobat-style)."""
+    doc = fitz.open(stream=make_template(), filetype="pdf")
+    widget = next(w for w in doc[0].widgets() if w.field_name == "ja_2")
+    kid = widget.xref
+    parent = doc.get_new_xref()
+    doc.update_object(parent, f"<</FT/Btn/T(ja_2)/V/Off/Kids[{kid} 0 R]>>")
+    for key in ("T", "FT", "V"):
+        doc.xref_set_key(kid, key, "null")
+    doc.xref_set_key(kid, "Parent", f"{parent} 0 R")
+    catalog = doc.pdf_catalog()
+    fields = doc.xref_get_key(catalog, "AcroForm/Fields")[1]
+    doc.xref_set_key(catalog, "AcroForm/Fields", fields.replace(f"{kid} 0 R", f"{parent} 0 R"))
+    out = doc.tobytes()
+    doc.close()
+    return out, parent
+
+
+def test_fill_template_pdf_sets_parent_field_of_kid_widget():
+    template, parent = make_template_with_kid_checkbox()
+    out = app.fill_template_pdf(template, {"speicher_kwh": "10"}, "01.02.2026")
+
+    doc = fitz.open(stream=out, filetype="pdf")
+    assert doc.xref_get_key(parent, "V")[1].lstrip("/") == "Yes"
+    doc.close()
+    assert read_fields(out)["ja_2"] not in ("Off", "", None)
+
+
+def make_source(*pages: str) -> bytes:
+    doc = fitz.open()
+    for text in pages:
+        doc.new_page().insert_text((50, 60), text, fontsize=10)
+    out = doc.tobytes()
+    doc.close()
+    return out
+
+
+def test_extract_requested_fields_section_continues_across_pages():
+    source = make_source(
+        "\n".join(app.HEADERS),
+        "Hersteller Speicher XYZ",
+        "Bruttokapazität des Speichereinheit: 10",
+    )
+    results = app.extract_requested_fields(source)
+
+    assert results == {"Angaben zur Speichereinheit": ["Bruttokapazität des Speichereinheit: 10"]}
+    assert app.build_extracted_dict(results)["speicher_kwh"] == "10"
+
+
+def test_iter_lines_stops_after_last_section_is_complete():
+    source = make_source(
+        "Stellvertreter\nFirma: ACME GmbH\nAnschlussnehmer\nHerr Max Muster\nAnschrift: Weg 1\n"
+        "Anschlussort\nAngaben zur Kundenanlage\nAngaben zu den PV-Modulen",
+        "Angaben zur Speichereinheit\nBruttokapazität des Speichereinheit: 10",
+        "Boilerplate",
+    )
+    lines = list(app.iter_lines(source))
+
+    assert lines[-1] == "Bruttokapazität des Speichereinheit: 10"
+    assert app.extract_requested_fields(source) == {
+        "Stellvertreter": ["Firma: ACME GmbH"],
+        "Anschlussnehmer": ["Name: Herr Max Muster", "Anschrift: Weg 1"],
+        "Angaben zur Speichereinheit": ["Bruttokapazität des Speichereinheit: 10"],
+    }